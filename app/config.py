@@ -1,7 +1,28 @@
 import os
+from dataclasses import dataclass
+from functools import lru_cache
+
 from dotenv import load_dotenv
 
-load_dotenv()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-USDA_API_KEY = os.getenv("USDA_API_KEY")
+@dataclass(frozen=True)
+class Settings:
+    GEMINI_API_KEY: str | None
+    USDA_API_KEY: str | None
+    DATABASE_URL: str
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    # Parse .env exactly once per process; every module reads the same object.
+    load_dotenv()
+    return Settings(
+        GEMINI_API_KEY=os.getenv("GEMINI_API_KEY"),
+        USDA_API_KEY=os.getenv("USDA_API_KEY"),
+        DATABASE_URL=os.getenv(
+            "DATABASE_URL", "sqlite+aiosqlite:///./nutrition_cache.db"
+        ),
+    )
+
+
+settings = get_settings()
@@ -1,10 +1,11 @@
-from sqlalchemy import Column, String, JSON, DateTime
+from sqlalchemy import Column, String, JSON, DateTime, event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
 from datetime import datetime
-import os
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./nutrition_cache.db")
+from app.config import settings
+
+DATABASE_URL = settings.DATABASE_URL
 
 
 class Base(DeclarativeBase):
@@ -19,7 +20,35 @@ class NutritionCache(Base):
 
 
 # Create async engine and session factory
-engine = create_async_engine(DATABASE_URL, echo=False, future=True)
+engine = create_async_engine(
+    DATABASE_URL,
+    echo=False,
+    future=True,
+    pool_size=20,
+    max_overflow=10,
+    pool_recycle=3600,
+)
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune SQLite for concurrent cache reads/writes (WAL, relaxed fsync)."""
+    if ":memory:" in DATABASE_URL:
+        return
+    cursor = dbapi_connection.cursor()
+    # Only takes effect if the database file has not been created yet.
+    cursor.execute("PRAGMA page_size=8192")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    # Memory-map reads (256 MiB) so cache hits skip the read() syscall path.
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA wal_autocheckpoint=1000")
+    cursor.close()
+
+
 AsyncSessionLocal = async_sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
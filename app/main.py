@@ -1,29 +1,46 @@
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from app.models import RecommendationRequest, FoodRecommendationResponse
-from app.services import get_recommendations
-from dotenv import load_dotenv
-import os
+from app.services import get_recommendations, close_http_client
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from fastapi.middleware.cors import CORSMiddleware
-from app.db import init_db
+from fastapi.responses import ORJSONResponse
+from app.db import init_db, close_db
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-load_dotenv()
+
+def _start_log_listener() -> QueueListener:
+    """Routes log records through a queue so handler I/O never blocks the event loop."""
+    root = logging.getLogger()
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = QueueListener(
+        log_queue, *root.handlers, respect_handler_level=True
+    )
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    log_listener = _start_log_listener()
     await init_db()
     yield
+    await close_http_client()
+    await close_db()
+    log_listener.stop()
 
 app = FastAPI(
     title="Healthy Food Recommender API",
     description="An AI-powered API to recommend healthy foods for various health conditions.",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware to allow frontend requests
@@ -47,7 +64,14 @@ def read_root():
 @app.post("/recommendations", response_model=FoodRecommendationResponse)
 async def get_food_recommendations(request: RecommendationRequest):
 
-    logger.info(f"Received recommendation request: {request.model_dump_json()}")
+    logger.info(
+        "Received recommendation request: search_type=%s value_len=%d has_country=%s",
+        request.search_type,
+        len(request.value),
+        request.country is not None,
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Full recommendation request: %s", request.model_dump_json())
 
     if not request.value:
         raise HTTPException(
@@ -67,4 +91,4 @@ async def get_food_recommendations(request: RecommendationRequest):
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from enum import Enum
 from typing import Optional
 
@@ -16,8 +16,16 @@ class RecommendationRequest(BaseModel):
 
 
 class FoodItem(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     name: str
     reason: str
+    calories: Optional[float] = None
+    protein: Optional[float] = None
+    carbohydrates: Optional[float] = None
+    fat: Optional[float] = None
+    sugar: Optional[float] = None
+    sodium: Optional[float] = None
 
 
 class DietaryPrinciple(BaseModel):
@@ -1,38 +1,415 @@
+import asyncio
 import hashlib
-import json
-import re
-from typing import Any, cast
+import logging
+import time
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Mapping, cast
 from datetime import datetime, timedelta, timezone
 
+import httpx
+import orjson
 from google import genai
+from google.genai import types as genai_types
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
-from app.config import GEMINI_API_KEY
+from app.config import settings
 from app.db import AsyncSessionLocal, NutritionCache
 from app.models import (
     DietaryPrinciple,
-    FoodItem,  
+    FoodItem,
     FoodRecommendationResponse,
     RecommendationRequest,
     SearchType,
 )
-from app.schemas import GeminiResponse
+from app.schemas import GeminiResponse, NutrientData
+
+logger = logging.getLogger(__name__)
 
 NUTRITION_CACHE_TTL_DAYS = 30
+NUTRITION_CACHE_TTL = timedelta(days=NUTRITION_CACHE_TTL_DAYS)
+# Failed/empty USDA lookups are cached too, but expire much sooner so a
+# transient miss doesn't stick for a month.
+NUTRITION_NEGATIVE_TTL = timedelta(days=1)
+
+# JSON mode makes Gemini return bare JSON, so no markdown fences to strip.
+GEMINI_GENERATION_CONFIG = genai_types.GenerateContentConfig(
+    response_mime_type="application/json"
+)
+
+
+# One client for the process; constructing it per request reloads credentials
+# and rebuilds the SDK's transport stack. Built lazily (mirroring
+# get_settings) so importing the module never requires a key: with none
+# configured, the first request raises inside the per-request try and the
+# endpoint degrades to the empty default response as before.
+@lru_cache(maxsize=1)
+def _get_gemini_client() -> genai.Client:
+    if settings.GEMINI_API_KEY:
+        return genai.Client(api_key=settings.GEMINI_API_KEY)
+    return genai.Client()
+
+
+# Prompt pieces are precomputed per SearchType so each request only pays for
+# a couple of .format() calls instead of rebuilding the whole skeleton.
+_PROMPT_CORE_TEMPLATES: dict[SearchType, str] = {
+    SearchType.CONDITION: " for a person with '{value}',",
+    SearchType.GOAL: " for a person whose goal is '{value}',",
+    SearchType.COUNTRY: " list healthy foods and foods to avoid that are common in '{value}'.",
+}
+
+_COUNTRY_CONSTRAINT_TEMPLATE = (
+    " The recommendations should be foods commonly found in '{country}'."
+)
+
+_PROMPT_TEMPLATE = """
+As a nutritionist,{prompt_core} provide a list of 4 recommended foods and 4 foods to strictly avoid.
+For each food, give a brief reason and approximate nutrition per 100g (numbers, or null if unsure).
+Also, provide 3 key dietary principles relevant to the query.{country_constraint}
+Output in the following JSON format:
+{{
+  "recommended_foods": [{{"name": "Food Name", "reason": "Reason", "nutrition": {{"calories": 0, "protein": 0, "carbohydrates": 0, "fat": 0, "sugar": 0, "sodium": 0}}}}],
+  "foods_to_avoid": [{{"name": "Food Name", "reason": "Reason", "nutrition": {{"calories": 0, "protein": 0, "carbohydrates": 0, "fat": 0, "sugar": 0, "sodium": 0}}}}],
+  "dietary_principles": [{{"principle": "Principle", "explanation": "Explanation"}}]
+}}
+"""
+
+
+def _build_prompt(request: RecommendationRequest) -> str:
+    prompt_core = _PROMPT_CORE_TEMPLATES.get(
+        request.search_type, _PROMPT_CORE_TEMPLATES[SearchType.CONDITION]
+    ).format(value=request.value)
+    country_constraint = (
+        _COUNTRY_CONSTRAINT_TEMPLATE.format(country=request.country)
+        if request.country
+        else ""
+    )
+    return _PROMPT_TEMPLATE.format(
+        prompt_core=prompt_core, country_constraint=country_constraint
+    )
+
+
+USDA_SEARCH_URL = "https://api.nal.usda.gov/fdc/v1/foods/search"
+
+# Global cap on concurrent USDA calls so multi-tenant bursts don't trip the
+# API's rate limit or drain the shared connection pool.
+USDA_MAX_CONCURRENCY = 10
+_USDA_SEMAPHORE = asyncio.Semaphore(USDA_MAX_CONCURRENCY)
+
+# Shared HTTP client so USDA lookups reuse keep-alive connections instead of
+# paying a DNS lookup + TLS handshake per food item.
+HTTP_CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(15.0),
+    limits=httpx.Limits(
+        max_connections=100,
+        max_keepalive_connections=50,
+        keepalive_expiry=15.0,
+    ),
+)
+
+
+async def close_http_client():
+    await HTTP_CLIENT.aclose()
+
+
+# Strong refs so fire-and-forget tasks aren't garbage-collected mid-flight.
+_background_tasks: set["asyncio.Task[None]"] = set()
+
+
+async def _warm_usda_connection() -> None:
+    """Speculatively opens a keep-alive USDA connection.
+
+    Fired while the Gemini call is in flight so the later nutrition
+    fan-out finds an established TLS connection in the pool.
+    """
+    try:
+        await HTTP_CLIENT.get(
+            USDA_SEARCH_URL,
+            params={
+                "query": "a",
+                "api_key": settings.USDA_API_KEY,
+                "pageSize": 1,
+            },
+        )
+    except Exception:
+        pass
+
+
+# Frozen module-level constants so the hot loops don't re-allocate them.
+_NUTRIENT_MAP: Mapping[str, str] = MappingProxyType(
+    {
+        "Energy": "calories",
+        "Protein": "protein",
+        "Carbohydrate, by difference": "carbohydrates",
+        "Total lipid (fat)": "fat",
+        "Sugars, total including NLEA": "sugar",
+        "Sodium, Na": "sodium",
+    }
+)
+
+_EMPTY_NUTRIENTS: Mapping[str, float | None] = MappingProxyType(
+    {
+        "calories": None,
+        "protein": None,
+        "carbohydrates": None,
+        "fat": None,
+        "sugar": None,
+        "sodium": None,
+    }
+)
+
+
+def _create_default_nutrients() -> NutrientData:
+    return cast(NutrientData, dict(_EMPTY_NUTRIENTS))
+
+
+async def get_usda_nutrition_data(food_name: str) -> NutrientData:
+    """Fetches nutrition facts for a food from the USDA FoodData Central API."""
+    if not settings.USDA_API_KEY or not food_name.strip():
+        return _create_default_nutrients()
+
+    try:
+        response = await HTTP_CLIENT.get(
+            USDA_SEARCH_URL,
+            params={
+                "query": food_name,
+                "api_key": settings.USDA_API_KEY,
+                "pageSize": 1,
+                "dataType": "Foundation,SR Legacy",
+            },
+        )
+        response.raise_for_status()
+        # Decode straight from the response bytes; no intermediate str.
+        foods = (await _loads_async(response.content)).get("foods", [])
+        if not foods:
+            return _create_default_nutrients()
+
+        # One pass over the ~50-nutrient report, then a 6-entry map walk,
+        # instead of per-nutrient dict chains.
+        reported = {
+            nutrient.get("nutrientName"): nutrient.get("value")
+            for nutrient in foods[0].get("foodNutrients", [])
+        }
+        nutrients = _create_default_nutrients()
+        for name, key in _NUTRIENT_MAP.items():
+            if name in reported:
+                nutrients[key] = reported[name]
+        return nutrients
+    except Exception as e:
+        logger.warning("USDA API error for %r: %s", food_name, e)
+        return _create_default_nutrients()
+
+
+def _nutrients_from_item(item: dict[str, Any]) -> NutrientData | None:
+    """Pulls Gemini's per-food nutrition estimate out of an item, if usable."""
+    estimate = item.get("nutrition")
+    if not isinstance(estimate, dict):
+        return None
+    data = _create_default_nutrients()
+    found = False
+    for key in _EMPTY_NUTRIENTS:
+        value = estimate.get(key)
+        if isinstance(value, (int, float)):
+            data[key] = float(value)
+            found = True
+    return data if found else None
 
 
 def _get_request_hash(request: RecommendationRequest) -> str:
-    # Use model_dump_json to get a consistent JSON string representation
-    request_string = request.model_dump_json(sort_keys=True)
-    return hashlib.sha256(request_string.encode()).hexdigest()
+    # Canonical pipe-joined tuple: no serializer walk at all, and
+    # normalizing case/whitespace lets "Diabetes" and "diabetes " share
+    # a cache entry. blake2b beats sha256 on short messages and this is
+    # a cache key, not a security boundary.
+    key = "|".join(
+        (
+            request.search_type.value,
+            request.value.strip().lower(),
+            (request.country or "").strip().lower(),
+        )
+    )
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
 
 
 def _clean_json_response(text: str) -> str:
     """Extracts the JSON content from a Gemini response that might include markdown."""
-    match = re.search(r"```json\s*([\s\S]*?)\s*```", text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return text.strip()
+    # The fence delimiters are fixed literals, so two C-level find() scans
+    # beat the regex engine and cannot backtrack on pathological input.
+    start = text.find("```json")
+    if start < 0:
+        return text.strip()
+    start += len("```json")
+    end = text.find("```", start)
+    if end < 0:
+        return text[start:].strip()
+    return text[start:end].strip()
+
+
+# Payloads above this size get parsed off the event loop; smaller ones stay
+# inline because the thread hop costs more than the parse.
+_PARSE_OFFLOAD_THRESHOLD = 8192
+
+
+async def _loads_async(payload: str | bytes) -> Any:
+    if len(payload) > _PARSE_OFFLOAD_THRESHOLD:
+        return await asyncio.to_thread(orjson.loads, payload)
+    return orjson.loads(payload)
+
+
+def _nutrition_cache_key(food_name: str) -> str:
+    # Prefixed so food-name entries never collide with Gemini request hashes.
+    return "usda:" + food_name.lower().strip()
+
+
+def _as_utc(dt: datetime) -> datetime:
+    # SQLite stores no timezone offset, so cached timestamps come back naive
+    # even though every row is written with a UTC datetime. Reattach UTC so
+    # they compare cleanly against the aware `now` used for TTL checks.
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+# Read-only cache lookups fetch bare column tuples; instrumenting a full ORM
+# object (identity map, change tracking) is wasted work for a KV read.
+_CACHE_READ_COLS = (
+    NutritionCache.__table__.c.response,
+    NutritionCache.__table__.c.last_updated,
+)
+
+
+# In-process L1 in front of the SQLite cache: popular foods resolve with a
+# dict lookup instead of a DB round-trip + ORM materialization per request.
+_NUTRITION_L1_MAX = 1024
+_NUTRITION_L1_TTL_SECONDS = 60 * 60
+_nutrition_l1: dict[str, tuple[float, NutrientData]] = {}
+
+
+def _l1_get(key: str) -> NutrientData | None:
+    entry = _nutrition_l1.get(key)
+    if entry is None:
+        return None
+    inserted_at, data = entry
+    if time.monotonic() - inserted_at > _NUTRITION_L1_TTL_SECONDS:
+        del _nutrition_l1[key]
+        return None
+    return data
+
+
+def _l1_put(key: str, data: NutrientData) -> None:
+    if len(_nutrition_l1) >= _NUTRITION_L1_MAX:
+        # Evict the oldest insertion; good enough for a popular-foods cache.
+        del _nutrition_l1[next(iter(_nutrition_l1))]
+    _nutrition_l1[key] = (time.monotonic(), data)
+
+
+async def _get_nutrition_for_foods(
+    db: AsyncSession, food_names: list[str]
+) -> dict[str, NutrientData]:
+    """Read-through cache for USDA lookups, persisted in NutritionCache.
+
+    New results are merged into the caller's session but not committed;
+    the caller batches all cache writes for a request into one commit.
+    """
+    nutrition: dict[str, NutrientData] = {}
+    now = datetime.now(timezone.utc)
+
+    # Gemini can repeat a food across both lists; resolve each name once.
+    food_names = list(dict.fromkeys(food_names))
+
+    pending: list[str] = []
+    for name in food_names:
+        hot = _l1_get(_nutrition_cache_key(name))
+        if hot is not None:
+            nutrition[name] = hot
+        else:
+            pending.append(name)
+
+    # One SELECT ... IN for every remaining name instead of a round-trip each.
+    if pending:
+        keys_to_names = {_nutrition_cache_key(name): name for name in pending}
+        try:
+            rows = await db.execute(
+                select(
+                    NutritionCache.__table__.c.request_hash, *_CACHE_READ_COLS
+                ).where(NutritionCache.request_hash.in_(keys_to_names))
+            )
+            for key, response, last_updated in rows:
+                data = cast(NutrientData, response)
+                # All-None rows are negative entries from empty USDA
+                # responses; honor them only for the short TTL.
+                ttl = (
+                    NUTRITION_NEGATIVE_TTL
+                    if all(value is None for value in data.values())
+                    else NUTRITION_CACHE_TTL
+                )
+                if _as_utc(last_updated) > now - ttl:
+                    nutrition[keys_to_names[key]] = data
+                    _l1_put(key, data)
+        except Exception:
+            logger.exception("Nutrition cache read error")
+
+    missing = [name for name in food_names if name not in nutrition]
+    if missing:
+        # Concurrent but bounded fan-out; get_usda_nutrition_data swallows
+        # its own errors, so the TaskGroup never aborts mid-flight.
+        async def _bounded_fetch(name: str) -> NutrientData:
+            async with _USDA_SEMAPHORE:
+                return await get_usda_nutrition_data(name)
+
+        async with asyncio.TaskGroup() as tg:
+            tasks = [tg.create_task(_bounded_fetch(name)) for name in missing]
+        results = [task.result() for task in tasks]
+
+        # Every fetch yields a dict — get_usda_nutrition_data swallows its
+        # own errors and falls back to empty nutrients — so all results go
+        # straight into the caches.
+        fresh_rows: list[dict[str, Any]] = []
+        for name, result in zip(missing, results):
+            nutrition[name] = result
+            _l1_put(_nutrition_cache_key(name), result)
+            fresh_rows.append(
+                {
+                    "request_hash": _nutrition_cache_key(name),
+                    "response": result,
+                    "last_updated": now,
+                }
+            )
+
+        # One multi-row upsert for all fresh results instead of a
+        # merge (SELECT + UPDATE/INSERT) per food.
+        try:
+            stmt = sqlite_insert(NutritionCache).values(fresh_rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["request_hash"],
+                set_={
+                    "response": stmt.excluded.response,
+                    "last_updated": stmt.excluded.last_updated,
+                },
+            )
+            await db.execute(stmt)
+        except Exception:
+            logger.exception("Nutrition cache write error")
+
+    return nutrition
+
+
+def _build_food_items(
+    items: list[dict[str, Any]], nutrition_by_name: dict[str, NutrientData]
+) -> list[FoodItem]:
+    return [
+        FoodItem.model_construct(
+            name=item["name"],
+            reason=item["reason"],
+            **nutrition_by_name[item["name"]],
+        )
+        for item in items
+    ]
+
+
+# In-flight tasks keyed by request hash: concurrent identical requests
+# piggyback on the first caller's work instead of each paying for Gemini.
+_INFLIGHT: dict[str, "asyncio.Task[FoodRecommendationResponse]"] = {}
 
 
 async def get_recommendations(
@@ -43,86 +420,101 @@ async def get_recommendations(
     repeated Gemini API calls.
     """
     request_hash = _get_request_hash(request)
+
+    task = _INFLIGHT.get(request_hash)
+    if task is None:
+        task = asyncio.create_task(_fetch_recommendations(request, request_hash))
+        _INFLIGHT[request_hash] = task
+        task.add_done_callback(lambda _: _INFLIGHT.pop(request_hash, None))
+    # Shielded so one caller disconnecting cannot cancel the shared task
+    # out from under the other waiters; the work runs to completion and
+    # still populates the cache even if every caller goes away.
+    return await asyncio.shield(task)
+
+
+async def _fetch_recommendations(
+    request: RecommendationRequest,
+    request_hash: str,
+) -> FoodRecommendationResponse:
+    # Runs on its own session: the callers' request-scoped sessions are
+    # torn down when their clients disconnect, which could otherwise yank
+    # the connection out from under a shared task mid-commit.
+    async with AsyncSessionLocal() as db:
+        return await _fetch_recommendations_with_session(request, request_hash, db)
+
+
+async def _fetch_recommendations_with_session(
+    request: RecommendationRequest,
+    request_hash: str,
+    db: AsyncSession,
+) -> FoodRecommendationResponse:
     gemini_data: GeminiResponse | None = None
+    now = datetime.now(timezone.utc)
 
     # 1. Check the database cache first
-    async with AsyncSessionLocal() as db:
-        try:
-            result = await db.execute(
-                select(NutritionCache).where(NutritionCache.request_hash == request_hash)
+    try:
+        row = (
+            await db.execute(
+                select(*_CACHE_READ_COLS).where(
+                    NutritionCache.request_hash == request_hash
+                )
             )
-            cached = result.scalar_one_or_none()
+        ).first()
 
-            if cached and cached.last_updated > datetime.now(timezone.utc) - timedelta(
-                days=NUTRITION_CACHE_TTL_DAYS
-            ):
-                print(f"Cache HIT for hash: {request_hash}")
-                gemini_data = cast(GeminiResponse, cached.response)
-        except Exception as e:
-            print(f"Database cache read error: {e}")
+        if row and _as_utc(row.last_updated) > now - NUTRITION_CACHE_TTL:
+            logger.info("Cache HIT for hash: %s", request_hash)
+            gemini_data = cast(GeminiResponse, row.response)
+    except Exception:
+        logger.exception("Database cache read error")
 
     # 2. If not in cache or expired, call the Gemini API
     if gemini_data is None:
-        print(f"Cache MISS for hash: {request_hash}. Calling Gemini API.")
-        base_prompt = "As a nutritionist,"
-        if request.search_type == SearchType.GOAL:
-            prompt_core = f" for a person whose goal is '{request.value}',"
-        elif request.search_type == SearchType.COUNTRY:
-            prompt_core = f" list healthy foods and foods to avoid that are common in '{request.value}'."
-        else:
-            prompt_core = f" for a person with '{request.value}',"
-
-        country_constraint = (
-            f" The recommendations should be foods commonly found in '{request.country}'."
-            if request.country
-            else ""
-        )
+        logger.info("Cache MISS for hash: %s. Calling Gemini API.", request_hash)
+        full_prompt = _build_prompt(request)
 
-        full_prompt = f"""
-        {base_prompt}{prompt_core} provide a list of 4 recommended foods and 4 foods to strictly avoid.
-        For each food, give a brief reason. Also, provide 3 key dietary principles relevant to the query.{country_constraint}
-        Output in the following JSON format:
-        {{
-          "recommended_foods": [{{"name": "Food Name", "reason": "Reason"}}],
-          "foods_to_avoid": [{{"name": "Food Name", "reason": "Reason"}}],
-          "dietary_principles": [{{"principle": "Principle", "explanation": "Explanation"}}]
-        }}
-        """
+        # Warm a USDA connection while Gemini thinks, so the nutrition
+        # fan-out afterwards skips the TLS handshake.
+        if settings.USDA_API_KEY:
+            warmup = asyncio.create_task(_warm_usda_connection())
+            _background_tasks.add(warmup)
+            warmup.add_done_callback(_background_tasks.discard)
 
         try:
-            client = (
-                genai.Client(api_key=GEMINI_API_KEY)
-                if GEMINI_API_KEY
-                else genai.Client()
-            )
-            response = await client.aio.models.generate_content(
-                model="gemini-2.5-flash", contents=full_prompt
+            response = await _get_gemini_client().aio.models.generate_content(
+                model="gemini-2.5-flash",
+                contents=full_prompt,
+                config=GEMINI_GENERATION_CONFIG,
             )
             if response.text:
-                cleaned_json = _clean_json_response(response.text)
-                gemini_data = cast(GeminiResponse, json.loads(cleaned_json))
-
-                # 3. Save the new response to the cache
-                async with AsyncSessionLocal() as db:
-                    try:
-                        existing = await db.get(NutritionCache, request_hash)
-                        if existing:
-                            existing.response = gemini_data
-                            existing.last_updated = datetime.now(timezone.utc)
-                        else:
-                            new_cache_entry = NutritionCache(
-                                request_hash=request_hash,
-                                response=gemini_data,
-                                last_updated=datetime.now(timezone.utc),
-                            )
-                            db.add(new_cache_entry)
-                        await db.commit()
-                    except Exception as e:
-                        print(f"Database cache write error: {e}")
-                        await db.rollback()
-
-        except (json.JSONDecodeError, AttributeError, Exception) as e:
-            print(f"Error processing Gemini response: {e}")
+                try:
+                    gemini_data = cast(
+                        GeminiResponse, await _loads_async(response.text)
+                    )
+                except orjson.JSONDecodeError:
+                    # Fallback in case the model ignored JSON mode
+                    gemini_data = cast(
+                        GeminiResponse,
+                        await _loads_async(_clean_json_response(response.text)),
+                    )
+
+                # 3. Queue the new response for the batched cache write;
+                # a single upsert replaces the racy get-then-write pair.
+                stmt = sqlite_insert(NutritionCache).values(
+                    request_hash=request_hash,
+                    response=gemini_data,
+                    last_updated=now,
+                )
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["request_hash"],
+                    set_={
+                        "response": stmt.excluded.response,
+                        "last_updated": stmt.excluded.last_updated,
+                    },
+                )
+                await db.execute(stmt)
+
+        except (orjson.JSONDecodeError, AttributeError, Exception):
+            logger.exception("Error processing Gemini response")
 
     # If Gemini call fails or returns no data, provide a default empty response
     if gemini_data is None:
@@ -132,19 +524,48 @@ async def get_recommendations(
             "dietary_principles": [],
         }
 
-    # 4. Process the final data into the response model
-    recommended_foods = [
-        FoodItem(name=item["name"], reason=item["reason"])
+    # 4. Fetch nutrition data for every food concurrently over the pooled client
+    recommended_items = [
+        item
         for item in gemini_data.get("recommended_foods", [])
         if isinstance(item, dict) and "name" in item and "reason" in item
     ]
-    foods_to_avoid = [
-        FoodItem(name=item["name"], reason=item["reason"])
+    avoid_items = [
+        item
         for item in gemini_data.get("foods_to_avoid", [])
         if isinstance(item, dict) and "name" in item and "reason" in item
     ]
+    all_items = recommended_items + avoid_items
+
+    # Prefer the nutrition estimates Gemini already returned in the same
+    # call; only foods it left blank (or older cached responses without
+    # the nutrition field) hit the USDA path.
+    gemini_nutrition: dict[str, NutrientData] = {}
+    usda_names: list[str] = []
+    for item in all_items:
+        estimated = _nutrients_from_item(item)
+        if estimated is not None:
+            gemini_nutrition[item["name"]] = estimated
+        else:
+            usda_names.append(item["name"])
+
+    nutrition_by_name = (
+        await _get_nutrition_for_foods(db, usda_names) if usda_names else {}
+    )
+    nutrition_by_name.update(gemini_nutrition)
+
+    # 5. Commit all cache writes from this request in a single transaction
+    try:
+        await db.commit()
+    except Exception:
+        logger.exception("Database cache write error")
+        await db.rollback()
+
+    # 6. Process the final data into the response model
+    recommended_foods = _build_food_items(recommended_items, nutrition_by_name)
+    foods_to_avoid = _build_food_items(avoid_items, nutrition_by_name)
     dietary_principles = [
-        DietaryPrinciple(principle=item["principle"], explanation=item["explanation"])
+        DietaryPrinciple.model_construct(principle=item["principle"], explanation=item["explanation"])
         for item in gemini_data.get("dietary_principles", [])
         if isinstance(item, dict) and "principle" in item and "explanation" in item
     ]
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app import services
+from app.db import Base, NutritionCache
+
+SAMPLE_NUTRIENTS = {
+    "calories": 52.0,
+    "protein": 0.3,
+    "carbohydrates": 14.0,
+    "fat": 0.2,
+    "sugar": 10.0,
+    "sodium": 1.0,
+}
+
+EMPTY_NUTRIENTS = dict(services._EMPTY_NUTRIENTS)
+
+
+@pytest_asyncio.fixture
+async def session_factory():
+    # In-memory database; aiosqlite pins :memory: to a single shared
+    # connection, so separate sessions see the same rows.
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield async_sessionmaker(engine, expire_on_commit=False)
+    await engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def clear_l1_cache():
+    # Each test exercises the persistent layer, so the in-process L1 must
+    # not short-circuit reads across tests.
+    services._nutrition_l1.clear()
+    yield
+    services._nutrition_l1.clear()
+
+
+@pytest.fixture
+def fake_usda(monkeypatch):
+    calls: list[str] = []
+
+    async def _fake(food_name: str):
+        calls.append(food_name)
+        return dict(SAMPLE_NUTRIENTS)
+
+    monkeypatch.setattr(services, "get_usda_nutrition_data", _fake)
+    return calls
+
+
+async def _seed_row(session_factory, key, response, age):
+    async with session_factory() as db:
+        db.add(
+            NutritionCache(
+                request_hash=key,
+                response=response,
+                last_updated=datetime.now(timezone.utc) - age,
+            )
+        )
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_second_request_hits_persistent_cache(session_factory, fake_usda):
+    async with session_factory() as db:
+        first = await services._get_nutrition_for_foods(db, ["apple"])
+        await db.commit()
+    assert first == {"apple": SAMPLE_NUTRIENTS}
+    assert fake_usda == ["apple"]
+
+    # Drop the L1 entry so the second request must go through SQLite.
+    services._nutrition_l1.clear()
+    async with session_factory() as db:
+        second = await services._get_nutrition_for_foods(db, ["apple"])
+    assert second == {"apple": SAMPLE_NUTRIENTS}
+    assert fake_usda == ["apple"], "persistent cache should prevent a refetch"
+
+
+@pytest.mark.asyncio
+async def test_fresh_negative_row_is_honored(session_factory, fake_usda):
+    await _seed_row(
+        session_factory, "usda:apple", EMPTY_NUTRIENTS, timedelta(hours=1)
+    )
+    async with session_factory() as db:
+        result = await services._get_nutrition_for_foods(db, ["apple"])
+    assert result == {"apple": EMPTY_NUTRIENTS}
+    assert fake_usda == []
+
+
+@pytest.mark.asyncio
+async def test_stale_negative_row_is_refetched(session_factory, fake_usda):
+    await _seed_row(
+        session_factory, "usda:apple", EMPTY_NUTRIENTS, timedelta(days=2)
+    )
+    async with session_factory() as db:
+        result = await services._get_nutrition_for_foods(db, ["apple"])
+    assert result == {"apple": SAMPLE_NUTRIENTS}
+    assert fake_usda == ["apple"]
+
+
+@pytest.mark.asyncio
+async def test_fresh_positive_row_is_honored(session_factory, fake_usda):
+    await _seed_row(
+        session_factory, "usda:apple", SAMPLE_NUTRIENTS, timedelta(days=29)
+    )
+    async with session_factory() as db:
+        result = await services._get_nutrition_for_foods(db, ["apple"])
+    assert result == {"apple": SAMPLE_NUTRIENTS}
+    assert fake_usda == []
+
+
+@pytest.mark.asyncio
+async def test_stale_positive_row_is_refetched(session_factory, fake_usda):
+    await _seed_row(
+        session_factory, "usda:apple", SAMPLE_NUTRIENTS, timedelta(days=31)
+    )
+    async with session_factory() as db:
+        await services._get_nutrition_for_foods(db, ["apple"])
+    assert fake_usda == ["apple"]